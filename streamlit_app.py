@@ -1,114 +1,212 @@
 import streamlit as st
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import base64
-from io import BytesIO, StringIO
-from PyPDF2 import PdfReader
+from io import BytesIO, TextIOWrapper
+import pypdfium2 as pdfium
 import csv
 import re
+import threading
+import zipfile
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from itertools import chain, repeat
 
 # Constants
 API_BASE_URL = "https://api.company-information.service.gov.uk"
 PDF_DOWNLOAD_URL = "https://find-and-update.company-information.service.gov.uk"
+MAX_STATEMENTS = 3  # Number of latest CS01 filings to fetch
+MAX_WORKERS = MAX_STATEMENTS  # One worker per confirmation statement
+# The category also returns other filings (e.g. RP04CS01 second filings), so
+# fetch a page with headroom for the CS01 filter to still find MAX_STATEMENTS
+FILING_HISTORY_PAGE_SIZE = 25
+REQUEST_TIMEOUT = (5, 30)  # Seconds to connect, seconds to read
+# The cached session is shared by every user, so its pools hold keep-alive
+# connections for many concurrent runs, not just one run's workers
+HTTP_POOL_SIZE = 32
+
+# Cache lifetimes (seconds): company numbers never change, CS01s are filed
+# yearly and filed documents are immutable
+COMPANY_NUMBER_TTL = 24 * 3600
+FILING_HISTORY_TTL = 3600
+PDF_TTL = 7 * 24 * 3600
+PDF_CACHE_ENTRIES = 64
+
+# Streamlit re-executes this script on every interaction, so process-wide
+# resources live in st.cache_resource rather than in module globals
+@st.cache_resource
+def get_session():
+    """Shared HTTP session reusing pooled keep-alive connections across reruns and users."""
+    session = requests.Session()
+    # One pool per Companies House host
+    session.mount("https://", HTTPAdapter(
+        pool_connections=2,
+        pool_maxsize=HTTP_POOL_SIZE,
+        max_retries=Retry(
+            total=3, backoff_factor=0.3, status_forcelist=[429, 500, 502, 503, 504], raise_on_status=False
+        ),
+    ))
+    return session
+
+@st.cache_resource
+def _pdfium_lock():
+    """Process-wide lock serialising PDFium, which is not thread-safe."""
+    return threading.Lock()
+
+SESSION = get_session()
+
+# Parser patterns, compiled once instead of on every shareholding block; like
+# str.strip(), allow indentation or a page-break form feed before a label
+_LABEL_LINE_RE = re.compile(r"^[ \t\f\v]*(Statement date|Shareholding\s+\d+|Name):(.*)$", re.MULTILINE)
+_DATE_RE = re.compile(r"\d{1,2}/\d{1,2}/\d{4}")
+_SHARES_HELD_RE = re.compile(r" shares held", re.IGNORECASE)
+
+@st.cache_resource(show_spinner=False)
+def _auth_header(api_key):
+    """Build the Basic auth header for the API key once per process and reuse it."""
+    return {"Authorization": f"Basic {base64.b64encode(f'{api_key}:'.encode()).decode()}"}
+
+@st.cache_data(ttl=COMPANY_NUMBER_TTL, show_spinner=False)
+def _search_company_number(legal_name, _api_key):
+    """Cached company search; raises on request errors so failures are never cached."""
+    url = f"{API_BASE_URL}/search/companies"
+    # params= URL-encodes names containing spaces, "&" or non-ASCII characters;
+    # only the top hit is read, so ask for one item instead of the default 20
+    params = {"q": legal_name, "items_per_page": 1}
+    response = SESSION.get(url, params=params, headers=_auth_header(_api_key), timeout=REQUEST_TIMEOUT)
+    response.raise_for_status()
+    items = response.json().get("items")
+    return items[0].get("company_number") if items else None
 
 def get_company_number(legal_name, api_key):
     """Fetch the company number using the legal name."""
-    url = f"{API_BASE_URL}/search/companies?q={legal_name}"
-    headers = {"Authorization": f"Basic {base64.b64encode(f'{api_key}:'.encode()).decode()}"}
-    response = requests.get(url, headers=headers)
-    if response.status_code != 200:
+    # Search is case- and whitespace-insensitive, so normalise the name to let
+    # near-duplicate inputs share one cache entry
+    normalised_name = " ".join(legal_name.split()).upper()
+    try:
+        return _search_company_number(normalised_name, api_key)
+    except requests.RequestException:
         st.error("Failed to fetch company information.")
         return None
-    data = response.json()
-    return data.get("items", [{}])[0].get("company_number")
+
+@st.cache_data(ttl=FILING_HISTORY_TTL, show_spinner=False)
+def _fetch_filing_history(company_number, _api_key):
+    """Cached filing-history lookup; raises on request errors so failures are never cached."""
+    # Let the API filter to confirmation statements instead of paging through everything
+    url = f"{API_BASE_URL}/company/{company_number}/filing-history"
+    params = {"category": "confirmation-statement", "items_per_page": FILING_HISTORY_PAGE_SIZE}
+    response = SESSION.get(url, params=params, headers=_auth_header(_api_key), timeout=REQUEST_TIMEOUT)
+    response.raise_for_status()
+    return response.json().get("items", [])
 
 def get_confirmation_statement_transaction_ids(company_number, api_key):
-    """Fetch the transaction IDs for the latest 100 items, and filter for 'CS01' type."""
-    url = f"{API_BASE_URL}/company/{company_number}/filing-history?items_per_page=100"
-    headers = {"Authorization": f"Basic {base64.b64encode(f'{api_key}:'.encode()).decode()}"}
-    response = requests.get(url, headers=headers)
-    
-    if response.status_code != 200:
+    """Fetch the transaction IDs of the latest confirmation statements ('CS01' type)."""
+    try:
+        items = _fetch_filing_history(company_number, api_key)
+    except requests.RequestException:
         st.error("Failed to fetch filing history.")
         return []
-    
-    data = response.json()
-    items = data.get("items", [])
-    transaction_ids = [
-        item.get("transaction_id")
-        for item in items
-        if item.get("type") and item["type"].lower() == "cs01"
-    ]
-    return transaction_ids[:3]  # Limit to the last 3 CS01 IDs
+
+    # The page is newest first, so stop as soon as the latest statements are found
+    transaction_ids = []
+    for item in items:
+        item_type = item.get("type")
+        if item_type and item_type.lower() == "cs01":
+            transaction_ids.append(item.get("transaction_id"))
+            if len(transaction_ids) == MAX_STATEMENTS:
+                break
+    return transaction_ids
+
+@st.cache_data(ttl=PDF_TTL, max_entries=PDF_CACHE_ENTRIES, show_spinner=False)
+def _fetch_pdf(company_number, transaction_id):
+    """Cached PDF download; filed documents are immutable, request errors raise and are not cached."""
+    url = f"{PDF_DOWNLOAD_URL}/company/{company_number}/filing-history/{transaction_id}/document?format=pdf&download=0"
+    response = SESSION.get(url, timeout=REQUEST_TIMEOUT)
+    response.raise_for_status()
+    return response.content
 
 def download_pdf(company_number, transaction_id):
     """Download the confirmation statement PDF."""
-    url = f"{PDF_DOWNLOAD_URL}/company/{company_number}/filing-history/{transaction_id}/document?format=pdf&download=0"
-    response = requests.get(url)
-    if response.status_code == 200:
-        return response.content
-    else:
+    try:
+        return _fetch_pdf(company_number, transaction_id)
+    except requests.RequestException:
         return None
 
+@st.cache_data(max_entries=PDF_CACHE_ENTRIES, show_spinner=False)
 def extract_text_from_pdf(pdf_content):
-    """Extract text from a PDF file."""
-    pdf_reader = PdfReader(BytesIO(pdf_content))
-    text_content = "\n".join(page.extract_text() for page in pdf_reader.pages)
-    return text_content
-
-from collections import defaultdict
-
-def process_text_to_csv(text_content, legal_name, company_number, statement_number):
+    """Extract text from a PDF file with PDFium."""
+    # PDFium is not thread-safe, so serialise calls from the statement workers
+    with _pdfium_lock():
+        pdf = pdfium.PdfDocument(pdf_content)
+        try:
+            # Close each page and its text page as soon as it is read, so native
+            # memory stays bounded to one page instead of waiting for the GC
+            page_texts = []
+            for page in pdf:
+                textpage = page.get_textpage()
+                page_texts.append(textpage.get_text_range())
+                textpage.close()
+                page.close()
+            return "\n".join(page_texts)
+        finally:
+            pdf.close()
+
+def _statement_date(text_content, match):
+    """Return the statement date, falling back to a date on the line after the label."""
+    value = match.group(2).strip()
+    if not value:
+        # PDFium puts the date on the line after "Statement date:"; anything else
+        # there (a page footer, the next label) means the field is blank
+        line_end = text_content.find("\n", match.end() + 1)
+        next_line = text_content[match.end() + 1:line_end if line_end != -1 else None].strip()
+        if _DATE_RE.fullmatch(next_line):
+            value = next_line
+    return value
+
+def _shares_held(details):
+    """Return (amount, type) from "... <amount> <type> shares held", or None if absent."""
+    # A literal search and plain token scans stay linear on any input (no
+    # backtracking); searching details itself keeps the offset valid, since
+    # str.lower() can change the string's length
+    shares_held = _SHARES_HELD_RE.search(details)
+    if not shares_held:
+        return None
+    words = details[:shares_held.start()].split()
+
+    # The type is a run of alphanumeric words just before "shares held"; the
+    # amount is the leftmost number that only such words follow
+    type_start = len(words)
+    while type_start > 0 and words[type_start - 1].isascii() and words[type_start - 1].isalnum():
+        type_start -= 1
+    for i in range(max(type_start - 1, 0), len(words) - 1):
+        amount_text = words[i].replace(",", "")
+        if amount_text.isdecimal():
+            return int(amount_text), " ".join(words[i + 1:]).title()
+    return None
+
+def process_text_to_csv(text_content, legal_name, company_number):
     """Process text content to generate a CSV for an individual statement."""
-    lines = text_content.split("\n")
-
-    # Initialize CSV data with statement information
-    csv_data = [
-        ["Company Legal Name", legal_name],
-        ["Company Number", company_number],
-        ["Statement Date", ""],  # Placeholder for the statement date
-        [],  # Empty row separator
-    ]
-
     statement_date = ""
     shareholder_data = []  # To collect rows of shareholder information
     share_totals = defaultdict(int)  # To aggregate total shares by type
 
-    i = 0
-    while i < len(lines):
-        line = lines[i].strip()
-
-        # Extract confirmation statement date
-        if line.startswith("Statement date:"):
-            statement_date = line.split(":")[1].strip()
-            csv_data[2][1] = statement_date  # Update the statement date
-
-        # Detect shareholding line
-        if line.startswith("Shareholding"):
-            # Initialize buffer to collect multi-line details
-            buffer = line
-
-            # Look ahead to collect additional lines
-            j = i + 1
-            while j < len(lines):
-                next_line = lines[j].strip()
-
-                # Stop collecting if we hit a new block (e.g., Name: or Shareholding)
-                if next_line.startswith("Name:") or next_line.startswith("Shareholding"):
-                    break
-
-                # Append current line to buffer
-                buffer += " " + next_line
-                j += 1
+    # Stream the labelled lines, holding back at most one open shareholding block;
+    # the trailing None closes a block that runs to the end of the text
+    pending = None
+    for match in chain(_LABEL_LINE_RE.finditer(text_content), [None]):
+        # A shareholding block runs until the next labelled line (e.g., Name: or Shareholding)
+        if pending:
+            block_end = match.start() if match else len(text_content)
+            buffer = " ".join(text_content[pending.start():block_end].split())
 
             # Extract shareholding number
-            shareholding_number_match = re.search(r"Shareholding\s+(\d+):", buffer)
-            shareholding_number = shareholding_number_match.group(1) if shareholding_number_match else "Unknown"
+            shareholding_number = pending.group(1).split()[1]
 
             # Extract the total shares and type of shares
-            total_shares_match = re.search(r"(\d{1,3}(?:,\d{3})*|\d+)\s+([A-Za-z0-9\s]+?)\s+shares\s+held", buffer, re.IGNORECASE)
-            if total_shares_match:
-                amount_of_shares = int(total_shares_match.group(1))
-                type_of_shares = total_shares_match.group(2).strip().title()
+            shares_held = _shares_held(buffer.partition(":")[2])
+            if shares_held:
+                amount_of_shares, type_of_shares = shares_held
                 # Add to share totals
                 share_totals[type_of_shares] += amount_of_shares
             else:
@@ -117,50 +215,73 @@ def process_text_to_csv(text_content, legal_name, company_number, statement_numb
 
             # Extract shareholder name
             shareholder_name = ""
-            if j < len(lines) and lines[j].strip().startswith("Name:"):
-                shareholder_name = lines[j].strip().split(":")[1].strip()
+            if match and match.group(1) == "Name":
+                shareholder_name = match.group(2).strip()
 
             # Append extracted data
             shareholder_data.append([
                 shareholding_number, amount_of_shares, type_of_shares, shareholder_name or "PENDING"
             ])
+            pending = None
+
+        if match is None:
+            break
+        label = match.group(1)
 
-            # Move to the next unprocessed line
-            i = j
-        else:
-            i += 1
+        # Extract confirmation statement date
+        if label == "Statement date":
+            statement_date = _statement_date(text_content, match)
+        elif label.startswith("Shareholding"):
+            pending = match
+
+    # Write rows straight into a UTF-8 byte buffer, the form the ZIP bundle
+    # stores; the header waits for the statement date
+    csv_buffer = BytesIO()
+    csv_stream = TextIOWrapper(csv_buffer, encoding="utf-8", newline="", write_through=True)
+    writer = csv.writer(csv_stream)
+    writer.writerows([
+        ["Company Legal Name", legal_name],
+        ["Company Number", company_number],
+        ["Statement Date", statement_date],
+        [],  # Empty row separator
+    ])
 
     # Add calculated totals for each share type to the CSV
-    csv_data.append(["Type of Shares", "Total Number of Shares"])
-    for share_type, total in share_totals.items():
-        csv_data.append([share_type, total])
+    writer.writerow(["Type of Shares", "Total Number of Shares"])
+    writer.writerows(share_totals.items())
 
     # Add a blank row to separate shareholding data
-    csv_data.append([])
+    writer.writerow([])
 
     # Append shareholder headers and data
-    shareholder_headers = ["Shareholding #", "Amount of Shares", "Type of Shares", "Shareholder Name"]
-    csv_data.append(shareholder_headers)
-    csv_data.extend(shareholder_data)
+    writer.writerow(["Shareholding #", "Amount of Shares", "Type of Shares", "Shareholder Name"])
+    writer.writerows(shareholder_data)
+    csv_stream.detach()  # Keep csv_buffer open once the wrapper is collected
+    return csv_buffer.getvalue(), statement_date
 
-    # Create CSV buffer
-    csv_buffer = StringIO()
-    writer = csv.writer(csv_buffer)
-    writer.writerows(csv_data)
-    csv_buffer.seek(0)
-    return csv_buffer, statement_date
+
+def process_statement(legal_name, company_number, transaction_id):
+    """Download, extract and parse a single confirmation statement."""
+    pdf_content = download_pdf(company_number, transaction_id)
+    if not pdf_content:
+        return None
+
+    text_content = extract_text_from_pdf(pdf_content)
+    csv_content, statement_date = process_text_to_csv(text_content, legal_name, company_number)
+    return pdf_content, csv_content, statement_date
+
+
+def _zip_name_part(text):
+    """Make text safe for a ZIP member name; path separators would create folders."""
+    return text.strip().replace("/", "-").replace("\\", "-")
 
 
 def main():
     st.title("Company Confirmation Statement Downloader")
 
     # Initialize session state
-    if "pdf_files" not in st.session_state:
-        st.session_state.pdf_files = []
-    if "csv_files" not in st.session_state:
-        st.session_state.csv_files = []
-    if "consolidated_csv" not in st.session_state:
-        st.session_state.consolidated_csv = ""
+    if "bundle" not in st.session_state:
+        st.session_state.bundle = None  # (file name, ZIP bytes) of the last run
 
     # Input for company legal name
     legal_name = st.text_input("Enter Company Legal Name:", "")
@@ -184,49 +305,47 @@ def main():
             return
 
         # Reset session state
-        st.session_state.pdf_files = []
-        st.session_state.csv_files = []
-        csv_buffers = []
-
-        for idx, transaction_id in enumerate(transaction_ids):
-            # Download PDF and extract text
-            pdf_content = download_pdf(company_number, transaction_id)
-            if not pdf_content:
-                continue
-
-            # Extract statement_date and process the text
-            text_content = extract_text_from_pdf(pdf_content)
-            csv_buffer, statement_date = process_text_to_csv(
-                text_content, legal_name, company_number, idx + 1
-            )
-
-            # Generate file names with dynamic statement_date
-            pdf_name = f"{legal_name}_pdf_{statement_date}.pdf"
-            csv_name = f"{legal_name}_csv_{statement_date}.csv"
-
-            # Store PDFs and CSVs in session state
-            st.session_state.pdf_files.append((pdf_name, pdf_content))
-            st.session_state.csv_files.append((csv_name, csv_buffer.getvalue()))
-            csv_buffers.append(csv_buffer)
-
-    # Add download buttons for PDF and CSV files
-    for idx, (pdf_name, pdf_content) in enumerate(st.session_state.pdf_files):
-        st.download_button(
-            label=f"Download {pdf_name}",
-            data=pdf_content,
-            file_name=pdf_name,
-            mime="application/pdf",
-            key=f"pdf_download_{idx}"
-        )
+        st.session_state.bundle = None
+
+        # Download and parse the statements concurrently (results keep filing order)
+        with ThreadPoolExecutor(max_workers=min(MAX_WORKERS, len(transaction_ids))) as executor:
+            results = [
+                (transaction_id, result)
+                for transaction_id, result in zip(transaction_ids, executor.map(
+                    process_statement,
+                    repeat(legal_name),
+                    repeat(company_number),
+                    transaction_ids,
+                ))
+                if result is not None
+            ]
+        if not results:
+            st.error("Failed to download confirmation statements.")
+            return
 
-    for idx, (csv_name, csv_content) in enumerate(st.session_state.csv_files):
+        # Bundle every PDF and CSV into one in-memory ZIP behind a single download
+        # button; the PDFs are already compressed, so a low level only squeezes the CSVs
+        file_stem = _zip_name_part(legal_name)
+        zip_buffer = BytesIO()
+        with zipfile.ZipFile(zip_buffer, "w", zipfile.ZIP_DEFLATED, compresslevel=1) as bundle:
+            for transaction_id, (pdf_content, csv_content, statement_date) in results:
+                # Generate file names with dynamic statement_date; the transaction ID
+                # keeps statements with a blank or repeated date from overwriting each other
+                file_date = _zip_name_part(statement_date)
+                bundle.writestr(f"{file_stem}_pdf_{file_date}_{transaction_id}.pdf", pdf_content)
+                bundle.writestr(f"{file_stem}_csv_{file_date}_{transaction_id}.csv", csv_content)
+        st.session_state.bundle = (f"{file_stem}_bundle.zip", zip_buffer.getvalue())
+
+    # Add a download button for the bundled PDF and CSV files
+    if st.session_state.bundle:
+        zip_name, zip_content = st.session_state.bundle
         st.download_button(
-            label=f"Download {csv_name}",
-            data=csv_content,
-            file_name=csv_name,
-            mime="text/csv",
-            key=f"csv_download_{idx}"
+            label=f"Download {zip_name}",
+            data=zip_content,
+            file_name=zip_name,
+            mime="application/zip",
+            key="bundle_download"
         )
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
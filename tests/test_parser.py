@@ -0,0 +1,95 @@
+import csv
+import io
+import unittest
+
+from streamlit_app import process_text_to_csv
+
+
+def parse(text):
+    """Run the parser and return (CSV rows, statement date)."""
+    csv_content, statement_date = process_text_to_csv(text, "ACME LIMITED", "01234567")
+    return list(csv.reader(io.StringIO(csv_content.decode("utf-8")))), statement_date
+
+
+class ProcessTextToCsvTest(unittest.TestCase):
+    def test_statement_date_on_following_line(self):
+        text = (
+            "Statement date:\r\n01/02/2024\r\n"
+            "Shareholding 1: 100 ORDINARY shares held\r\nName: ALICE\r\n"
+        )
+        rows, statement_date = parse(text)
+        self.assertEqual(statement_date, "01/02/2024")
+        self.assertEqual(rows[-1], ["1", "100", "Ordinary", "ALICE"])
+
+    def test_blank_name_before_page_footer(self):
+        text = (
+            "Shareholding 1: 100 ORDINARY shares held\r\nName:\r\n"
+            "Electronically filed document for Company Number: 11400135\n"
+        )
+        rows, _ = parse(text)
+        self.assertEqual(rows[-1], ["1", "100", "Ordinary", "PENDING"])
+
+    def test_blank_statement_date_before_page_footer(self):
+        text = (
+            "Statement date:\r\n"
+            "Electronically filed document for Company Number: 11400135\n"
+            "Shareholding 1: 100 ORDINARY shares held\r\nName: ALICE\r\n"
+        )
+        rows, statement_date = parse(text)
+        self.assertEqual(statement_date, "")
+        self.assertEqual(rows[2], ["Statement Date", ""])
+
+    def test_amount_after_leading_words(self):
+        text = (
+            "Shareholding 1: There were 100 ORDINARY shares held\nName: ALICE\n"
+            "Shareholding 2: 1,000 ORDINARY A shares held as at the date\nName: BOB\n"
+        )
+        rows, _ = parse(text)
+        self.assertEqual(rows[-2:], [
+            ["1", "100", "Ordinary", "ALICE"],
+            ["2", "1000", "Ordinary A", "BOB"],
+        ])
+        self.assertIn(["Ordinary", "100"], rows)
+
+    def test_text_that_lengthens_when_lowercased(self):
+        # "İ".lower() is two characters, which must not shift the type slice
+        rows, _ = parse("Shareholding 1: İİİİ 100 ORDINARY Shares Held\nName: ALICE\n")
+        self.assertEqual(rows[-1], ["1", "100", "Ordinary", "ALICE"])
+
+    def test_labels_after_form_feed(self):
+        text = (
+            "\fStatement date: 01/02/2024\n"
+            "Shareholding 1: 100 ORDINARY shares held\n\f"
+            "Name: ALICE\n\f\v"
+            "Shareholding 2: 5 DEFERRED shares held\nName: BOB\n"
+        )
+        rows, statement_date = parse(text)
+        self.assertEqual(statement_date, "01/02/2024")
+        self.assertEqual(rows[-2:], [
+            ["1", "100", "Ordinary", "ALICE"],
+            ["2", "5", "Deferred", "BOB"],
+        ])
+        self.assertIn(["Deferred", "5"], rows)
+
+    def test_blank_name_is_pending(self):
+        text = (
+            "Shareholding 1: 100 ORDINARY shares held\nName:\n"
+            "Shareholding 2: 5 ORDINARY shares held\nName: BOB\n"
+        )
+        rows, _ = parse(text)
+        self.assertEqual(rows[-2:], [
+            ["1", "100", "Ordinary", "PENDING"],
+            ["2", "5", "Ordinary", "BOB"],
+        ])
+        self.assertIn(["Ordinary", "105"], rows)
+
+    def test_blank_statement_date(self):
+        text = "Statement date:\nShareholding 1: 100 ORDINARY shares held\nName: ALICE\n"
+        rows, statement_date = parse(text)
+        self.assertEqual(statement_date, "")
+        self.assertEqual(rows[2], ["Statement Date", ""])
+        self.assertEqual(rows[-1], ["1", "100", "Ordinary", "ALICE"])
+
+
+if __name__ == "__main__":
+    unittest.main()